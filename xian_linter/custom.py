@@ -1,6 +1,8 @@
 import ast
 import sys
 
+from typing import Any, Callable, ClassVar, Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
 from contracting import constants
 
 from contracting.compilation.whitelists import (
@@ -11,167 +13,284 @@ from contracting.compilation.whitelists import (
     ILLEGAL_AST_TYPES
 )
 
+# Frozen copies of the whitelists for constant-time membership tests,
+# whatever container type contracting ships them as
+_ILLEGAL = frozenset(ILLEGAL_AST_TYPES)
+_ALLOWED = frozenset(ALLOWED_AST_TYPES)
+_ALLOWED_ANNOTATIONS = frozenset(ALLOWED_ANNOTATION_TYPES)
+_ILLEGAL_BUILTINS = frozenset(ILLEGAL_BUILTINS)
+_ORM_CLASS_NAMES = frozenset(constants.ORM_CLASS_NAMES)
+_VALID_DECORATORS = frozenset(constants.VALID_DECORATORS)
+
+# Interned so comparisons against (interned) AST identifiers hit the
+# identity fast path
+_EXPORT = sys.intern(constants.EXPORT_DECORATOR_STRING)
+_INIT = sys.intern(constants.INIT_DECORATOR_STRING)
+_BUILTIN_MODULES = frozenset(sys.stdlib_module_names) | frozenset(sys.builtin_module_names)
+
+_IMPORT_TYPES = (ast.Import, ast.ImportFrom)
+
+# Names that may not be referenced at all: the runtime module and every
+# illegal builtin except float
+_FORBIDDEN_NAMES = (_ILLEGAL_BUILTINS - {'float'}) | {'rt'}
+
+# Violation messages, bound once instead of indexing VIOLATION_TRIGGERS
+# every time a violation is reported
+_VT0 = VIOLATION_TRIGGERS[0]
+_VT1 = VIOLATION_TRIGGERS[1]
+_VT2 = VIOLATION_TRIGGERS[2]
+_VT3 = VIOLATION_TRIGGERS[3]
+_VT5 = VIOLATION_TRIGGERS[5]
+_VT6 = VIOLATION_TRIGGERS[6]
+_VT7 = VIOLATION_TRIGGERS[7]
+_VT8 = VIOLATION_TRIGGERS[8]
+_VT9 = VIOLATION_TRIGGERS[9]
+_VT10 = VIOLATION_TRIGGERS[10]
+_VT11 = VIOLATION_TRIGGERS[11]
+_VT12 = VIOLATION_TRIGGERS[12]
+_VT13 = VIOLATION_TRIGGERS[13]
+_VT14 = VIOLATION_TRIGGERS[14]
+_VT15 = VIOLATION_TRIGGERS[15]
+_VT16 = VIOLATION_TRIGGERS[16]
+_VT18 = VIOLATION_TRIGGERS[18]
+
+# Fields that hold identifiers or plain values rather than child nodes, per
+# node class. Keyed by class since a field name like 'name' is a str on
+# FunctionDef but an ast.Name on TypeAlias (3.12+)
+_SCALAR_FIELDS: Dict[str, Tuple[str, ...]] = {
+    'FunctionDef': ('name', 'type_comment'),
+    'AsyncFunctionDef': ('name', 'type_comment'),
+    'ClassDef': ('name',),
+    'Name': ('id',),
+    'Attribute': ('attr',),
+    'alias': ('name', 'asname'),
+    'arg': ('arg', 'type_comment'),
+    'keyword': ('arg',),
+    'ImportFrom': ('module', 'level'),
+    'ExceptHandler': ('name',),
+    'MatchAs': ('name',),
+    'MatchStar': ('name',),
+    'Constant': ('kind',),
+    'FormattedValue': ('conversion',),
+    'comprehension': ('is_async',),
+    'AnnAssign': ('simple',),
+    'Assign': ('type_comment',),
+    'For': ('type_comment',),
+    'AsyncFor': ('type_comment',),
+    'With': ('type_comment',),
+    'AsyncWith': ('type_comment',),
+}
+
+# Child fields per node class, resolved once at import so that generic_visit
+# does not have to go through ast.iter_fields() for every node
+_CHILD_FIELDS: Dict[type, Tuple[str, ...]] = {
+    cls: tuple(f for f in cls._fields if f not in _SCALAR_FIELDS.get(cls.__name__, ()))
+    for cls in vars(ast).values()
+    if isinstance(cls, type) and issubclass(cls, ast.AST)
+}
+
+# Fields holding the nested statement lists of compound statements, exception
+# handlers and match cases
+_STMT_LIST_FIELDS = ('body', 'orelse', 'finalbody', 'handlers', 'cases')
+
+# Leaf nodes that carry nothing the linter checks, so generic_visit can
+# return right away instead of looking at their fields
+_LEAF_EXPR_TYPES = frozenset({
+    ast.Constant, ast.Load, ast.Store, ast.Del
+}) - _ILLEGAL
+
+# Node classes with a dedicated visitor method. ast.Num is left out since
+# parsed trees only contain ast.Constant nodes.
+_VISITED_TYPES = (
+    ast.Name, ast.Attribute, ast.Import, ast.ImportFrom, ast.ClassDef,
+    ast.AsyncFunctionDef, ast.Assign, ast.AugAssign, ast.Call, ast.FunctionDef
+)
+
+
+def _dispatch_table(cls: type) -> Dict[type, Callable[..., Any]]:
+    """Map node classes to cls's visitor functions, used instead of
+    NodeVisitor's per-node getattr(self, 'visit_' + classname) lookup"""
+    return {t: getattr(cls, 'visit_' + t.__name__) for t in _VISITED_TYPES}
+
 
 class Linter(ast.NodeVisitor):
 
-    def __init__(self):
-        self._violations = []
-        self._functions = []
-        self._is_one_export = False
-        self._is_success = True
-        self._constructor_visited = False
-        self.orm_names = set()
-        self.visited_args = set()
-        self.return_annotation = set()
-        self.arg_types = set()
+    _dispatch: ClassVar[Dict[type, Callable[..., Any]]]
+
+    def __init__(self) -> None:
+        self._violations: List[str] = []
+        self._functions: List[str] = []
+        self._is_one_export: bool = False
+        self._is_success: bool = True
+        self._constructor_visited: bool = False
+        self._has_function: bool = False
+        self.orm_names: Set[str] = set()
+
+        self.builtins: FrozenSet[str] = _BUILTIN_MODULES
 
-        self.builtins = list(set(list(sys.stdlib_module_names) + list(sys.builtin_module_names)))
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._dispatch = _dispatch_table(cls)
 
-    def ast_types(self, t, lnum):
-        if type(t) not in ALLOWED_AST_TYPES:
-            str = "Line {}".format(lnum) + " : " + VIOLATION_TRIGGERS[0] + " : {}".format(type(t).__name__)
-            self._violations.append(str)
+    def ast_types(self, t: ast.AST, lnum: int) -> None:
+        if type(t) not in _ALLOWED:
+            self._violations.append(f"Line {lnum} : {_VT0} : {type(t).__name__}")
             self._is_success = False
 
-    def not_system_variable(self, v, lnum):
+    def not_system_variable(self, v: str, lnum: int) -> None:
         if v.startswith('_') or v.endswith('_'):
-            str = "Line {} : ".format(lnum) + VIOLATION_TRIGGERS[1] + " : {}".format(v)
-            self._violations.append(str)
+            self._violations.append(f"Line {lnum} : {_VT1} : {v}")
             self._is_success = False
 
-    def no_nested_imports(self, node):
+    def no_nested_imports(self, node: ast.FunctionDef) -> None:
+        # Every nested import reports the same function line, so one is enough
         for item in node.body:
-            if type(item) in [ast.ImportFrom, ast.Import]:
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[2]
-                self._violations.append(str)
+            if isinstance(item, _IMPORT_TYPES):
+                self._violations.append(f"Line {node.lineno}: {_VT2}")
                 self._is_success = False
+                break
 
-    def visit_Name(self, node):
-        self.not_system_variable(node.id, node.lineno)
-
-        if node.id == 'rt':
+    def visit_Name(self, node: ast.Name) -> ast.Name:
+        # Name only has a ctx child, so there is nothing to descend into
+        nid = node.id
+        if nid[:1] == '_' or nid[-1:] == '_':
+            self._violations.append(f"Line {node.lineno} : {_VT1} : {nid}")
             self._is_success = False
-            str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-            self._violations.append(str)
 
-        if node.id in ILLEGAL_BUILTINS and node.id != 'float':
+        if nid in _FORBIDDEN_NAMES:
             self._is_success = False
-            str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-            self._violations.append(str)
+            self._violations.append(f"Line {node.lineno}: {_VT13}")
 
-        self.generic_visit(node)
         return node
 
-    def visit_Attribute(self, node):
+    def visit_Attribute(self, node: ast.Attribute) -> ast.Attribute:
         self.not_system_variable(node.attr, node.lineno)
         if node.attr == 'rt':
             self._is_success = False
-            str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-            self._violations.append(str)
+            self._violations.append(f"Line {node.lineno}: {_VT13}")
         self.generic_visit(node)
         return node
 
-    def visit_Import(self, node):
+    def _collect_import_names(self, node: Union[ast.Import, ast.ImportFrom]) -> None:
+        for n in node.names:
+            if n.asname:
+                self._functions.append(n.asname)
+            else:
+                self._functions.append(n.name.split('.')[-1])
+
+    def visit_Import(self, node: ast.Import) -> ast.Import:
+        self._collect_import_names(node)
         for n in node.names:
             if n.name in self.builtins:
                 self._is_success = False
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-                self._violations.append(str)
+                self._violations.append(f"Line {node.lineno}: {_VT13}")
         return node
 
-    def visit_ImportFrom(self, node):
-        str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[3]
-        self._violations.append(str)
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        self._collect_import_names(node)
+        self._violations.append(f"Line {node.lineno}: {_VT3}")
         self._is_success = False
 
-    def visit_ClassDef(self, node):
-        str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[5]
-        self._violations.append(str)
+    def visit_ClassDef(self, node: ast.ClassDef) -> ast.ClassDef:
+        self._violations.append(f"Line {node.lineno}: {_VT5}")
         self._is_success = False
         self.generic_visit(node)
         return node
 
-    def visit_AsyncFunctionDef(self, node):
-        str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[6]
-        self._violations.append(str)
+    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef) -> ast.AsyncFunctionDef:
+        self._violations.append(f"Line {node.lineno}: {_VT6}")
 
         self._is_success = False
         self.generic_visit(node)
         return node
 
-    def visit_Assign(self, node):
+    def visit_Assign(self, node: ast.Assign) -> ast.Assign:
         if isinstance(node.value, ast.Name):
             if node.value.id == 'Hash' or node.value.id == 'Variable':
                 self._is_success = False
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-                self._violations.append(str)
+                self._violations.append(f"Line {node.lineno}: {_VT13}")
 
-        if (isinstance(node.value, ast.Call) and not
-        isinstance(node.value.func, ast.Attribute) and
-                node.value.func.id in constants.ORM_CLASS_NAMES):
+        # Any non-Attribute callee is assumed to be a Name; anything else
+        # raises AttributeError, which check() reports
+        call: Any = node.value if isinstance(node.value, ast.Call) else None
+        if (call is not None and not
+        isinstance(call.func, ast.Attribute) and
+                call.func.id in _ORM_CLASS_NAMES):
 
-            if node.value.func.id in ['Variable', 'Hash']:
-                kwargs = [k.arg for k in node.value.keywords]
+            if call.func.id in ['Variable', 'Hash']:
+                kwargs = [k.arg for k in call.keywords]
                 if 'contract' in kwargs or 'name' in kwargs:
                     self._is_success = False
-                    str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[10]
-                    self._violations.append(str)
-            if ast.Tuple in [type(t) for t in node.targets] or isinstance(node.value, ast.Tuple):
+                    self._violations.append(f"Line {node.lineno}: {_VT10}")
+            if any(type(t) is ast.Tuple for t in node.targets) or isinstance(node.value, ast.Tuple):
                 self._is_success = False
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[11]
-                self._violations.append(str)
-            try:
-                self.orm_names.add(node.targets[0].id)
-            except AttributeError:
-                pass
+                self._violations.append(f"Line {node.lineno}: {_VT11}")
 
         self.generic_visit(node)
         return node
 
-    def visit_AugAssign(self, node):
+    def visit_AugAssign(self, node: ast.AugAssign) -> ast.AugAssign:
         self.generic_visit(node)
         return node
 
-    def visit_Call(self, node: ast.Call):
+    def visit_Call(self, node: ast.Call) -> ast.Call:
         if isinstance(node.func, ast.Name):
-            if node.func.id in ILLEGAL_BUILTINS:
+            if node.func.id in _ILLEGAL_BUILTINS:
                 self._is_success = False
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[13]
-                self._violations.append(str)
+                self._violations.append(f"Line {node.lineno}: {_VT13}")
 
         self.generic_visit(node)
         return node
 
-    def generic_visit(self, node):
-        if type(node) in ILLEGAL_AST_TYPES:
-            self._is_success = False
-            s = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[0]
-            self._violations.append(s)
+    def visit(self, node: ast.AST) -> Any:
+        fn = self._dispatch.get(type(node))
+        if fn is not None:
+            return fn(self, node)
+        return self.generic_visit(node)
 
-        return super().generic_visit(node)
+    def generic_visit(self, node: Any) -> None:
+        node_type = type(node)
+        if node_type in _LEAF_EXPR_TYPES:
+            return
 
-    def visit_Num(self, node):
+        if node_type in _ILLEGAL:
+            self._is_success = False
+            self._violations.append(f"Line {node.lineno}: {_VT0}")
+
+        visit = self.visit
+        for field in _CHILD_FIELDS.get(node_type, node._fields):
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        visit(item)
+            elif isinstance(value, ast.AST):
+                visit(value)
+
+    def visit_Num(self, node: ast.AST) -> ast.AST:
         self.generic_visit(node)
         return node
 
-    def visit_FunctionDef(self, node):
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.FunctionDef:
+        self._functions.append(node.name)
+        self._has_function = True
+
         self.no_nested_imports(node)
 
         # Make sure there are no closures
         try:
             for n in node.body:
                 if isinstance(n, ast.FunctionDef):
-                    str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[18]
-                    self._violations.append(str)
+                    self._violations.append(f"Line {node.lineno}: {_VT18}")
                     self._is_success = False
         except:
             pass
 
         # Only allow 1 decorator per function definition
         if len(node.decorator_list) > 1:
-            str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[9] + \
-                  ": Detected: {} MAX limit: 1".format(len(node.decorator_list))
-            self._violations.append(str)
+            self._violations.append(
+                f"Line {node.lineno}: {_VT9}: Detected: {len(node.decorator_list)} MAX limit: 1"
+            )
             self._is_success = False
 
         export_decorator = False
@@ -183,139 +302,118 @@ class Linter(ast.NodeVisitor):
 
             if decorator_name is None:
                 # Complex decorator, log a violation
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[7]
-                self._violations.append(str)
+                self._violations.append(f"Line {node.lineno}: {_VT7}")
                 self._is_success = False
                 continue
 
             # Check if decorator is in valid decorators
-            if decorator_name not in constants.VALID_DECORATORS:
-                str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[7] + \
-                      f": Invalid decorator '{decorator_name}'. Valid list: {constants.VALID_DECORATORS}"
-                self._violations.append(str)
+            if decorator_name not in _VALID_DECORATORS:
+                self._violations.append(
+                    f"Line {node.lineno}: {_VT7}: Invalid decorator '{decorator_name}'. "
+                    f"Valid list: {constants.VALID_DECORATORS}"
+                )
                 self._is_success = False
 
-            if decorator_name == constants.EXPORT_DECORATOR_STRING:
+            if decorator_name == _EXPORT:
                 self._is_one_export = True
                 export_decorator = True
 
-            if decorator_name == constants.INIT_DECORATOR_STRING:
+            if decorator_name == _INIT:
                 if self._constructor_visited:
-                    str = "Line {}: ".format(node.lineno) + VIOLATION_TRIGGERS[8]
-                    self._violations.append(str)
+                    self._violations.append(f"Line {node.lineno}: {_VT8}")
                     self._is_success = False
                 self._constructor_visited = True
 
-        # Add argument names to set to make sure that no ORM
-        # variable names are being reused in function def args
+        # Make sure that no ORM variable names are being reused in function
+        # def args and that exported functions only use allowed annotations.
+        # ORM names are collected before the visit, so this can run inline.
         arguments = node.args
+        checked_types: Set[Optional[str]] = set()
         for a in arguments.args:
-            self.visited_args.add((a.arg, node.lineno))
+            if a.arg in self.orm_names:
+                self._violations.append(f"Line {node.lineno}: {_VT14}")
+                self._is_success = False
             if export_decorator:
-                if a.annotation is not None:
+                annotation: Any = a.annotation
+                arg: Optional[str]
+                if annotation is not None:
                     try:
-                        self.arg_types.add((a.annotation.id, node.lineno))
+                        arg = annotation.id
                     except AttributeError:
-                        arg = a.annotation.value.id + '.' + a.annotation.attr
-                        self.arg_types.add((arg, node.lineno))
+                        arg = annotation.value.id + '.' + annotation.attr
                 else:
-                    self.arg_types.add((None, node.lineno))
-
-        if export_decorator:
-            if node.returns is not None:
-                try:
-                    self.arg_types.add((a.annotation.id, node.lineno))
-                except AttributeError:
-                    arg = a.annotation.value.id + '.' + a.annotation.attr
-                    self.arg_types.add((arg, node.lineno))
-            else:
-                self.return_annotation.add((None, node.lineno))
+                    arg = None
+
+                # Report each annotation type once per function
+                if arg not in checked_types:
+                    checked_types.add(arg)
+                    self.annotation_types(arg, node.lineno)
 
         self.generic_visit(node)
         return node
 
-    def annotation_types(self, t, lnum):
+    def annotation_types(self, t: Optional[str], lnum: int) -> None:
         if t is None:
-            str = "Line {}".format(lnum) + " : " + VIOLATION_TRIGGERS[16]
-            self._violations.append(str)
+            self._violations.append(f"Line {lnum} : {_VT16}")
             self._is_success = False
-        elif t not in ALLOWED_ANNOTATION_TYPES:
-            str = "Line {}".format(lnum) + " : " + VIOLATION_TRIGGERS[15] + " : {}".format(t)
-            self._violations.append(str)
+        elif t not in _ALLOWED_ANNOTATIONS:
+            self._violations.append(f"Line {lnum} : {_VT15} : {t}")
             self._is_success = False
 
-    def check_return_types(self, t, lnum):
-        if t is not None:
-            str = "Line {}".format(lnum) + " : " + VIOLATION_TRIGGERS[17] + " : {}".format(t)
-            self._violations.append(str)
-            self._is_success = False
-
-    def _reset(self):
+    def _reset(self) -> None:
         self._violations = []
         self._functions = []
         self._is_one_export = False
         self._is_success = True
         self._constructor_visited = False
+        self._has_function = False
         self.orm_names = set()
-        self.visited_args = set()
-        self.return_annotation = set()
-        self.arg_types = set()
-
-    def _final_checks(self):
-        for name, lineno in self.visited_args:
-            if name in self.orm_names:
-                str = "Line {}: ".format(lineno) + VIOLATION_TRIGGERS[14]
-                self._violations.append(str)
-                self._is_success = False
 
-        # More robust first function line tracking
-        first_function_line = None
-        first_function_node = None
-        for node in ast.walk(self._ast_tree):
-            if isinstance(node, ast.FunctionDef):
-                first_function_node = node
-                first_function_line = node.lineno
-                break
-
-        if not self._is_one_export and first_function_node is not None:
-            # Use the actual first function's line number
-            str = f"Line {first_function_line - 1}: " + VIOLATION_TRIGGERS[12]
-            self._violations.append(str)
+    def _collect_orm_names(self, body: List[ast.stmt]) -> None:
+        # ORM variables have to be known before any function is visited, so
+        # collect them up front from every statement body in the module.
+        # Expressions cannot hold an Assign, so only statement lists are walked
+        add = self.orm_names.add
+        stack: List[Any] = list(body)
+        while stack:
+            node = stack.pop()
+            if (isinstance(node, ast.Assign) and
+                    isinstance(node.value, ast.Call) and
+                    isinstance(node.value.func, ast.Name) and
+                    node.value.func.id in _ORM_CLASS_NAMES and
+                    isinstance(node.targets[0], ast.Name)):
+                add(node.targets[0].id)
+            for field in _STMT_LIST_FIELDS:
+                stmts = getattr(node, field, None)
+                if stmts:
+                    stack.extend(stmts)
+
+    def _final_checks(self, ast_tree: Any) -> None:
+        if not self._is_one_export and self._has_function:
+            # Report the first function in breadth-first order, which is not
+            # necessarily the first one visit_FunctionDef saw. This walk only
+            # happens when the check fails
+            first_function_node = next(
+                n for n in ast.walk(ast_tree) if isinstance(n, ast.FunctionDef)
+            )
+            self._violations.append(f"Line {first_function_node.lineno - 1}: {_VT12}")
             self._is_success = False
 
-        for t, lineno in self.arg_types:
-            self.annotation_types(t, lineno)
-
-        for t, lineno in self.return_annotation:
-            self.check_return_types(t, lineno)
-
-    def _collect_function_defs(self, root):
-        for node in ast.walk(root):
-            if isinstance(node, ast.FunctionDef):
-                self._functions.append(node.name)
-            elif isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
-                for n in node.names:
-                    if n.asname:
-                        self._functions.append(n.asname)
-                    else:
-                        self._functions.append(n.name.split('.')[-1])
-
-    def check(self, ast_tree):
+    def check(self, ast_tree: Any) -> Optional[List[str]]:
         try:
             self._reset()
-            # Store the AST tree
-            self._ast_tree = ast_tree
 
             # Check for syntax errors first
             if isinstance(ast_tree, SyntaxError):
-                str = "Line {}: Syntax error: {}".format(ast_tree.lineno, str(ast_tree))
-                self._violations.append(str)
+                self._violations.append(f"Line {ast_tree.lineno}: Syntax error: {ast_tree}")
                 return self._violations
 
-            # Existing checks
-            self._collect_function_defs(ast_tree)
+            self._collect_orm_names(getattr(ast_tree, 'body', []))
+
+            # Function names, imports and whether any function exists are
+            # collected during this single visit
             self.visit(ast_tree)
-            self._final_checks()
+            self._final_checks(ast_tree)
 
             if self._is_success is False:
                 return self._violations
@@ -325,7 +423,11 @@ class Linter(ast.NodeVisitor):
             # Catch any unexpected errors
             return [f"Unexpected error during linting: {str(e)}"]
 
-    def dump_violations(self):
+    def dump_violations(self) -> None:
         import pprint
         pp = pprint.PrettyPrinter(indent=4)
         pp.pprint(self._violations)
+
+
+# Built once per class rather than for every Linter instance
+Linter._dispatch = _dispatch_table(Linter)
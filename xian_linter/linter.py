@@ -1,18 +1,25 @@
 import uvicorn
+import orjson
 import asyncio
 import ast
 import base64
 import gzip
+import hashlib
+import os
 import re
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from collections import OrderedDict
 from dataclasses import dataclass
 from functools import lru_cache
-from typing import Optional, List, Set
+from typing import Callable, Optional, List, Set, Tuple
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse
+from io import BytesIO
 from pydantic import BaseModel
-from io import StringIO
-from pyflakes.api import check
-from pyflakes.reporter import Reporter
+from pyflakes.checker import Checker
 from .custom import Linter
 
 
@@ -22,6 +29,9 @@ class Settings:
     def __init__(self):
         self.MAX_CODE_SIZE: int = 1_000_000  # 1MB
         self.CACHE_SIZE: int = 100
+        self.RESULT_CACHE_SIZE: int = 500
+        self.MAX_WORKERS: int = os.cpu_count() or 1
+        self.LIMIT_CONCURRENCY: int = 100
         self.DEFAULT_WHITELIST_PATTERNS: frozenset = frozenset({
             'export', 'construct', 'Hash', 'Variable', 'ctx', 'now',
             'random', 'ForeignHash', 'ForeignVariable', 'block_num',
@@ -38,6 +48,11 @@ class LintingException(Exception):
     pass
 
 
+class PayloadTooLargeException(Exception):
+    """Raised when decoded code exceeds the maximum code size"""
+    pass
+
+
 @dataclass(slots=True)
 class Position:
     """Represents a position in the source code"""
@@ -81,75 +96,70 @@ class LintResponse(BaseModel):
     errors: List[LintError_Model]
 
 
-app = FastAPI()
-
-# Compile regex patterns once
-PYFLAKES_PATTERN = re.compile(r'<string>:(\d+):(\d+):\s*(.+)')
-CONTRACTING_PATTERN = re.compile(r'Line (\d+):\s*(.+)')
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson instead of the stdlib json module"""
 
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
 
-def standardize_error_message(message: str) -> str:
-    """Standardize error message by removing extra location information."""
-    # Remove (<unknown>, line X) pattern from the end
-    location_pattern = r'\s*\(<unknown>,\s*line\s*\d+\)$'
-    message = re.sub(location_pattern, '', message)
-    return message
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Own the process pool that runs the CPU-bound linters"""
+    app.state.pool = ProcessPoolExecutor(max_workers=settings.MAX_WORKERS)
+    try:
+        yield
+    finally:
+        app.state.pool.shutdown()
 
-def is_duplicate_error(error1: LintError, error2: LintError) -> bool:
-    """Check if two errors are duplicates by comparing standardized messages and positions."""
-    msg1 = standardize_error_message(error1.message)
-    msg2 = standardize_error_message(error2.message)
 
-    # If messages are different, they're not duplicates
-    if msg1 != msg2:
-        return False
+app = FastAPI(lifespan=lifespan)
 
-    # If one has position and other doesn't, they're not duplicates
-    if bool(error1.position) != bool(error2.position):
-        return False
+# Compile regex patterns once
+CONTRACTING_PATTERN = re.compile(r'Line (\d+):\s*(.+)')
+LOCATION_PATTERN = re.compile(r'\s*\(<unknown>,\s*line\s*\d+\)$')
 
-    # If both have positions, compare them
-    if error1.position and error2.position:
-        return (error1.position.line == error2.position.line and
-                error1.position.column == error2.position.column)
 
-    # If neither has position, compare just messages
-    return True
+def standardize_error_message(message: str) -> str:
+    """Standardize error message by removing extra location information."""
+    # Remove (<unknown>, line X) pattern from the end
+    return LOCATION_PATTERN.sub('', message)
 
 
 def deduplicate_errors(errors: List[LintError]) -> List[LintError]:
-    """Remove duplicate errors while preserving order."""
+    """Remove duplicate errors while preserving order.
+
+    Errors are duplicates if their standardized messages and positions match.
+    """
+    seen = set()
     unique_errors = []
     for error in errors:
         # Standardize the message
         error.message = standardize_error_message(error.message)
+
+        if error.position:
+            key = (error.message, error.position.line, error.position.column)
+        else:
+            key = (error.message, None)
+
         # Only add if not a duplicate
-        if not any(is_duplicate_error(error, existing) for existing in unique_errors):
+        if key not in seen:
+            seen.add(key)
             unique_errors.append(error)
     return unique_errors
 
 
-def parse_pyflakes_line(line: str, whitelist_patterns: Set[str]) -> Optional[LintError]:
-    """Parse a Pyflakes error line into standardized format"""
-    # Strip any "Pyflakes error: " prefix if present
-    if line.startswith("Pyflakes error: "):
-        line = line[len("Pyflakes error: "):]
-
-    match = PYFLAKES_PATTERN.match(line)
-    if not match:
-        return None
-
-    line_num, col, message = match.groups()
-
+def parse_pyflakes_message(line_num: int, col: int, message: str,
+                           whitelist_patterns: Set[str]) -> Optional[LintError]:
+    """Convert a Pyflakes message into standardized format"""
     if any(pattern in message for pattern in whitelist_patterns):
         return None
 
     return LintError(
         message=message,
         position=Position(
-            line=int(line_num) - 1,
-            column=int(col) - 1
+            line=line_num - 1,
+            column=col
         )
     )
 
@@ -178,25 +188,34 @@ def parse_contracting_line(violation: str) -> LintError:
     return LintError(message=violation)
 
 
-async def run_pyflakes(code: str, whitelist_patterns: Set[str]) -> List[LintError]:
-    """Runs Pyflakes and returns standardized errors"""
-    try:
-        loop = asyncio.get_event_loop()
-        stdout = StringIO()
-        stderr = StringIO()
-        reporter = Reporter(stdout, stderr)
+def _run_pyflakes_on_tree(tree: ast.AST) -> List[Tuple[int, int, str]]:
+    """Run Pyflakes on an already parsed tree and return (line, column, message) tuples"""
+    # Same as pyflakes.api.check, minus the ast.parse it would do again and
+    # the Reporter round trip through formatted text
+    w = Checker(tree, filename="<string>")
+    w.messages.sort(key=lambda m: m.lineno)
+    return [
+        (m.lineno, m.col, (m.message % m.message_args).strip())
+        for m in w.messages
+    ]
 
-        await loop.run_in_executor(None, check, code, "<string>", reporter)
 
-        combined_output = stdout.getvalue() + stderr.getvalue()
-        errors = []
+def _lint_worker(code: str) -> Tuple[List[Tuple[int, int, str]], Optional[List[str]]]:
+    """Parse the code once and run both linters on it in a worker process"""
+    tree = ast.parse(code)
+    violations = Linter().check(tree)
+    pyflakes_messages = _run_pyflakes_on_tree(tree)
+    return pyflakes_messages, violations
+
 
-        for line in combined_output.splitlines():
-            line = line.strip()
-            if not line:
-                continue
+def collect_pyflakes_errors(messages: List[Tuple[int, int, str]],
+                            whitelist_patterns: Set[str]) -> List[LintError]:
+    """Convert Pyflakes messages into standardized errors"""
+    try:
+        errors = []
 
-            error = parse_pyflakes_line(line, whitelist_patterns)
+        for line_num, col, message in messages:
+            error = parse_pyflakes_message(line_num, col, message, whitelist_patterns)
             if error:
                 errors.append(error)
 
@@ -205,14 +224,9 @@ async def run_pyflakes(code: str, whitelist_patterns: Set[str]) -> List[LintErro
         raise LintingException(str(e)) from e
 
 
-async def run_contracting_linter(code: str) -> List[LintError]:
-    """Runs Contracting linter and returns standardized errors"""
+def collect_contracting_errors(violations: Optional[List[str]]) -> List[LintError]:
+    """Convert Contracting linter violations into standardized errors"""
     try:
-        loop = asyncio.get_event_loop()
-        tree = await loop.run_in_executor(None, ast.parse, code)
-        linter = Linter()
-        violations = await loop.run_in_executor(None, linter.check, tree)
-
         if not violations:
             return []
 
@@ -221,6 +235,29 @@ async def run_contracting_linter(code: str) -> List[LintError]:
             for v in violations
             if v.strip()
         ]
+    except Exception as e:
+        raise LintingException(str(e)) from e
+
+
+async def _run_in_pool(code: str) -> Tuple[List[Tuple[int, int, str]], Optional[List[str]]]:
+    """Lint code in the process pool, replacing the pool once if it is broken"""
+    loop = asyncio.get_running_loop()
+    pool = app.state.pool
+    try:
+        return await loop.run_in_executor(pool, _lint_worker, code)
+    except BrokenProcessPool:
+        # A worker died, which leaves the whole executor unusable. Swap in a
+        # fresh pool unless a concurrent request already did, then retry once
+        if app.state.pool is pool:
+            app.state.pool = ProcessPoolExecutor(max_workers=settings.MAX_WORKERS)
+            pool.shutdown(wait=False)
+        return await loop.run_in_executor(app.state.pool, _lint_worker, code)
+
+
+async def run_linters(code: str, whitelist_patterns: Set[str]) -> List[LintError]:
+    """Runs Pyflakes and the Contracting linter and returns standardized errors"""
+    try:
+        pyflakes_messages, violations = await _run_in_pool(code)
     except Exception as e:
         # Extract line number from AST SyntaxError if available
         if isinstance(e, SyntaxError) and e.lineno is not None:
@@ -230,6 +267,9 @@ async def run_contracting_linter(code: str) -> List[LintError]:
             )]
         raise LintingException(str(e)) from e
 
+    return (collect_pyflakes_errors(pyflakes_messages, whitelist_patterns) +
+            collect_contracting_errors(violations))
+
 
 @lru_cache(maxsize=settings.CACHE_SIZE)
 def get_whitelist_patterns(patterns_str: Optional[str] = None) -> frozenset:
@@ -239,17 +279,31 @@ def get_whitelist_patterns(patterns_str: Optional[str] = None) -> frozenset:
     return frozenset(patterns_str.split(","))
 
 
+# Lint results of recently submitted code, most recently used last
+_RESULT_CACHE: "OrderedDict[bytes, List[LintError]]" = OrderedDict()
+
+
+def result_cache_key(code: str, whitelist_patterns: Set[str]) -> bytes:
+    """Hash the code together with the whitelist patterns that filter its errors"""
+    h = hashlib.blake2b(code.encode("utf-8", errors="replace"), digest_size=16)
+    for pattern in sorted(whitelist_patterns):
+        h.update(b"\0" + pattern.encode("utf-8", errors="replace"))
+    return h.digest()
+
+
 async def lint_code(code: str, whitelist_patterns: Set[str]) -> List[LintError]:
-    """Run all linters in parallel"""
-    try:
-        pyflakes_task = run_pyflakes(code, whitelist_patterns)
-        contracting_task = run_contracting_linter(code)
+    """Run all linters on a single parse of the code"""
+    key = result_cache_key(code, whitelist_patterns)
+    cached = _RESULT_CACHE.get(key)
+    if cached is not None:
+        _RESULT_CACHE.move_to_end(key)
+        return cached
 
-        results = await asyncio.gather(pyflakes_task, contracting_task)
-        all_errors = results[0] + results[1]
+    try:
+        all_errors = await run_linters(code, whitelist_patterns)
 
         # Deduplicate errors
-        return deduplicate_errors(all_errors)
+        errors = deduplicate_errors(all_errors)
     except LintingException as e:
         error_msg = str(e)
         # Strip any known prefixes from the error message
@@ -259,27 +313,50 @@ async def lint_code(code: str, whitelist_patterns: Set[str]) -> List[LintError]:
                 break
         return [LintError(message=error_msg)]
 
+    # Only successful runs are cached, failures may be transient
+    _RESULT_CACHE[key] = errors
+    if len(_RESULT_CACHE) > settings.RESULT_CACHE_SIZE:
+        _RESULT_CACHE.popitem(last=False)
+    return errors
+
+
+def build_lint_response(errors: List[LintError]) -> ORJSONResponse:
+    """Build the response body straight from LintErrors, skipping pydantic"""
+    return ORJSONResponse({
+        "success": len(errors) == 0,
+        "errors": [
+            {
+                "message": e.message,
+                "severity": e.severity,
+                "position": {
+                    "line": e.position.line,
+                    "column": e.position.column
+                } if e.position else None
+            }
+            for e in errors
+        ]
+    })
 
-def convert_lint_error_to_model(error: LintError) -> LintError_Model:
-    """Convert a LintError to a LintError_Model"""
-    if error.position:
-        position = Position_Model(
-            line=error.position.line,
-            column=error.position.column
-        )
-    else:
-        position = None
 
-    return LintError_Model(
-        message=error.message,
-        severity=error.severity,
-        position=position
-    )
+def decompress_gzip(data: bytes, max_size: int) -> bytes:
+    """Decompress gzip data, reading at most one byte past max_size"""
+    # Bounded read instead of gzip.decompress so that a small payload
+    # expanding to gigabytes (gzip bomb) is never held in memory
+    with gzip.GzipFile(fileobj=BytesIO(data)) as f:
+        code_bytes = f.read(max_size + 1)
 
+    if len(code_bytes) > max_size:
+        raise PayloadTooLargeException("Decompressed code size too large")
+    return code_bytes
 
-@app.post("/lint_base64")
-async def lint_base64(request: Request) -> LintResponse:
-    """Lint base64-encoded Python code"""
+
+def decode_base64(data: bytes) -> bytes:
+    """Decode base64-encoded code"""
+    return base64.b64decode(data.decode("utf-8", errors="replace"))
+
+
+async def lint_payload(request: Request, decoder: Callable[[bytes], bytes]) -> ORJSONResponse:
+    """Validate the request body, decode it into code and lint it"""
     raw_data = await request.body()
 
     # Validate request
@@ -295,9 +372,7 @@ async def lint_base64(request: Request) -> LintResponse:
     )
 
     try:
-        # Decode base64
-        b64_text = raw_data.decode("utf-8", errors="replace")
-        code_bytes = base64.b64decode(b64_text)
+        code_bytes = decoder(raw_data)
         code = code_bytes.decode("utf-8", errors="replace")
 
         if not code.strip():
@@ -306,62 +381,46 @@ async def lint_base64(request: Request) -> LintResponse:
         # Run linters
         errors = await lint_code(code, whitelist_patterns)
 
-        return LintResponse(
-            success=len(errors) == 0,
-            errors=[convert_lint_error_to_model(e) for e in errors]
-        )
+        return build_lint_response(errors)
+    except PayloadTooLargeException as e:
+        raise HTTPException(status_code=413, detail=str(e)) from e
     except Exception as e:
-        return LintResponse(
-            success=False,
-            errors=[convert_lint_error_to_model(
-                LintError(message=f"Processing error: {str(e)}")
-            )]
-        )
-
-
-@app.post("/lint_gzip")
-async def lint_gzip(request: Request) -> LintResponse:
-    """Lint gzipped Python code"""
-    raw_data = await request.body()
-
-    # Validate request
-    if not raw_data:
-        raise HTTPException(status_code=400, detail="Empty request body")
+        return build_lint_response([
+            LintError(message=f"Processing error: {str(e)}")
+        ])
 
-    if len(raw_data) > settings.MAX_CODE_SIZE:
-        raise HTTPException(status_code=400, detail="Code size too large")
 
-    # Get and validate whitelist patterns
-    whitelist_patterns = get_whitelist_patterns(
-        request.query_params.get("whitelist_patterns")
-    )
+@app.post("/lint", response_class=ORJSONResponse, responses={200: {"model": LintResponse}})
+async def lint(request: Request) -> ORJSONResponse:
+    """Lint plain Python code"""
+    # No decoding step, the body is the code itself
+    return await lint_payload(request, lambda data: data)
 
-    try:
-        # Decompress gzip
-        code_bytes = gzip.decompress(raw_data)
-        code = code_bytes.decode("utf-8", errors="replace")
 
-        if not code.strip():
-            raise HTTPException(status_code=400, detail="Empty code")
+@app.post("/lint_base64", response_class=ORJSONResponse, responses={200: {"model": LintResponse}})
+async def lint_base64(request: Request) -> ORJSONResponse:
+    """Lint base64-encoded Python code"""
+    return await lint_payload(request, decode_base64)
 
-        # Run linters
-        errors = await lint_code(code, whitelist_patterns)
 
-        return LintResponse(
-            success=len(errors) == 0,
-            errors=[convert_lint_error_to_model(e) for e in errors]
-        )
-    except Exception as e:
-        return LintResponse(
-            success=False,
-            errors=[convert_lint_error_to_model(
-                LintError(message=f"Processing error: {str(e)}")
-            )]
-        )
+@app.post("/lint_gzip", response_class=ORJSONResponse, responses={200: {"model": LintResponse}})
+async def lint_gzip(request: Request) -> ORJSONResponse:
+    """Lint gzipped Python code"""
+    return await lint_payload(
+        request, lambda data: decompress_gzip(data, settings.MAX_CODE_SIZE)
+    )
 
 
 def run_server():
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # loop/http default to "auto", which picks uvloop and httptools when
+    # installed (uvicorn[standard]) and falls back to asyncio/h11 otherwise.
+    # One server process is enough since linting runs in the process pool.
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        limit_concurrency=settings.LIMIT_CONCURRENCY
+    )
 
 if __name__ == "__main__":
     run_server()